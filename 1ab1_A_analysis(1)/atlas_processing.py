@@ -1,67 +1,140 @@
 import mdtraj as md
 import numpy as np
+import pickle
 import torch
 import torch_geometric.data as Data
-import pickle
-from sklearn.neighbors import NearestNeighbors
+from numba import njit
+from joblib import Parallel, delayed
 # Open the XTC trajectory file
 def load_data():
     traj = md.load("1ab1_A_R1.xtc", top= "1ab1_A.pdb")
     # import pdb; pdb.set_trace()
     return traj
 
+# Fixed 20-letter amino acid order so one-hot indices are reproducible
+# across runs and trajectories (set() iteration order is not)
+AMINO_ACIDS = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS',
+               'ILE', 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP',
+               'TYR', 'VAL']
+amino_acid_to_index = {amino_acid: i for i, amino_acid in enumerate(AMINO_ACIDS)}
+EYE20 = np.eye(20, dtype=np.float32)
+
 def one_hot_encode(residues):
-    amino_acid_to_index = {amino_acid: i for i, amino_acid in enumerate(set(residues))}
-    indices = [amino_acid_to_index[aa] for aa in residues]
-    feats = []
-    for i in range(len(indices)):
-        arr = np.zeros(20)
-        arr[indices[i]] = 1
-        feats.append(arr)
-    return torch.tensor(feats, dtype=torch.float)
+    # One contiguous gather from the identity matrix instead of a Python
+    # loop of small allocations
+    indices = np.fromiter((amino_acid_to_index[aa] for aa in residues), dtype=np.int64)
+    return torch.from_numpy(EYE20[indices])
 
-def create_pyg_graph(traj, frame_idx, property):
-    # Extract coordinates and residue names for the specified frame
-    frame = traj[frame_idx]
-    residue_names = [residue.name for residue in frame.top.residues]
-    residue_coords = []
-    # with open('1ab1_A_RMSD.tsv', 'r') as file:
-    #     rmsd_data = file.readlines()
-    # rmsd_data = [line.split('\t')[1] for line in rmsd_data]
-    # rmsd_data = rmsd_data[1:]
-    # import pdb; pdb.set_trace()
-    # One-hot encode residue features
-    node_features = one_hot_encode(residue_names)
-    
-    for residue in frame.top.residues:
-        atom_indices = [atom.index for atom in residue.atoms]
-        atom_coords = frame.xyz[0][atom_indices]
-        mean_coords = np.mean(atom_coords, axis=0)
-        residue_coords.append(mean_coords)
+def make_knn_kernel(n_points, k):
+    # Build a brute-force kNN kernel specialized on this trajectory's residue
+    # count. n_points and k are closure constants at compile time, so LLVM can
+    # unroll the top-k insertion sort and fully vectorize the score loop. The
+    # half-norm trick scores neighbors as 0.5*||x_j||^2 - <x_i, x_j>, which
+    # preserves the euclidean distance ordering for a fixed query i.
+    @njit(cache=True, fastmath=True, boundscheck=False, nogil=True)
+    def knn_kernel(coords):
+        half_norms = 0.5 * (coords * coords).sum(axis=1)
+        nbrs = np.empty((n_points, k), dtype=np.int64)
+        for i in range(n_points):
+            scores = half_norms - coords.dot(coords[i])
+            best_scores = np.full(k, np.inf)
+            best_idx = np.zeros(k, dtype=np.int64)
+            for j in range(n_points):
+                if j == i:
+                    continue
+                s = scores[j]
+                if s < best_scores[k - 1]:
+                    # insertion sort into the running top-k
+                    pos = k - 1
+                    while pos > 0 and s < best_scores[pos - 1]:
+                        best_scores[pos] = best_scores[pos - 1]
+                        best_idx[pos] = best_idx[pos - 1]
+                        pos -= 1
+                    best_scores[pos] = s
+                    best_idx[pos] = j
+            nbrs[i] = best_idx
+        return nbrs
+    return knn_kernel
 
-    residue_coords = np.array(residue_coords)
+def residue_layout(traj):
+    # Atoms are stored residue-contiguously in mdtraj, so per-residue atom
+    # counts and their cumulative offsets describe the layout for every frame.
+    counts = np.array([residue.n_atoms for residue in traj.top.residues])
+    residue_starts = np.concatenate(([0], np.cumsum(counts[:-1])))
+    return residue_starts, counts
 
-    timepoint = traj.time[frame_idx]
+def residue_means(xyz, residue_starts, counts):
+    # Mean atom coordinates per residue for all frames at once: (T, A, 3) -> (T, N, 3)
+    # xyz is float32; keep the means float32 too instead of promoting to float64
+    sums = np.add.reduceat(xyz, residue_starts, axis=1)
+    return (sums / counts[None, :, None]).astype(np.float32, copy=False)
+
+def knn_all_frames(all_coords, k):
+    # kNN neighbor indices for every frame, shape (T, N, k). Frames are
+    # independent and share N, so one batched distance computation on GPU
+    # covers the whole trajectory; otherwise fall back to the JIT'd kernel.
+    if torch.cuda.is_available():
+        coords = torch.from_numpy(all_coords).cuda()
+        sq_norms = (coords * coords).sum(dim=-1)
+        sq_dists = sq_norms[:, :, None] - 2.0 * coords @ coords.transpose(1, 2) + sq_norms[:, None, :]
+        _, nbr_idx = torch.topk(sq_dists, k=k + 1, largest=False)
+        return nbr_idx[:, :, 1:].cpu().numpy()  # drop self
+    # Frames are embarrassingly parallel and the njit'd kernel releases the
+    # GIL, so threads scale across cores without pickling any coordinates
+    knn_kernel = make_knn_kernel(all_coords.shape[1], k)
+    knn_kernel(all_coords[0])  # compile once before fanning out
+    nbrs = Parallel(n_jobs=-1, prefer='threads')(
+        delayed(knn_kernel)(frame_coords) for frame_coords in all_coords)
+    return np.stack(nbrs)
+
+def compute_property(traj, property):
+    # One vectorized mdtraj call over the full trajectory instead of T
+    # per-frame calls; both functions return per-frame values along axis 0
     if property == 'rog':
-        y = md.compute_rg(frame)
+        return md.compute_rg(traj)                       # (T,)
     elif property == 'sasa':
-        y = md.shrake_rupley(frame, mode='residue')
+        return md.shrake_rupley(traj, mode='residue')    # (T, N)
     # elif property == 'rmsd':
-    #     y = rmsd_data[frame_idx]
+    #     with open('1ab1_A_RMSD.tsv', 'r') as file:
+    #         rmsd_data = file.readlines()
+    #     rmsd_data = [line.split('\t')[1] for line in rmsd_data]
+    #     return rmsd_data[1:]
+
+def stack_edge_indices(all_nbrs):
+    # COO edge lists for every frame in one preallocated (T, 2, 5N) tensor;
+    # the source pattern is identical across frames so it is written once
+    # int32 halves edge memory and is plenty for residue counts; rehydration
+    # casts back to int64 where PyG ops require it
+    n_frames, n_residues, k = all_nbrs.shape
+    src = torch.arange(n_residues, dtype=torch.int32).repeat_interleave(k)
+    edge_indices = torch.empty(n_frames, 2, k * n_residues, dtype=torch.int32)
+    edge_indices[:, 0] = src
+    edge_indices[:, 1] = torch.from_numpy(all_nbrs.reshape(n_frames, -1))
+    return edge_indices
+
+def create_pyg_graph(traj, frame_idx, property, node_features, residue_coords, edge_index, y):
+    timepoint = traj.time[frame_idx]
     # import pdb; pdb.set_trace()
-    # Construct PyTorch Geometric graph
-    graph = Data.Data(x=node_features, coords=residue_coords, time=timepoint, num_nodes=len(residue_names), y = y[0])
-    nn = NearestNeighbors(n_neighbors=5+1, metric='euclidean')
-    nn.fit(residue_coords)
-    _, indices = nn.kneighbors(residue_coords)
-    edge_index = []
-    for i in range(len(indices)):
-        for j in indices[i][1:]:
-            edge_index.append([i, j])  # Add edge between residue i and its k-nearest neighbor j
-    edge_index = torch.tensor(edge_index, dtype=torch.long).t().contiguous()  # Transpose for PyTorch format
-    graph.edge_index = edge_index
+    # Construct PyTorch Geometric graph; edge_index is a view into the
+    # stacked (T, 2, 5N) tensor, cast to int64 because these graphs feed
+    # MessagePassing/torch_scatter directly (via the legacy pickle), which
+    # both reject int32 indices. The .pt pack keeps the int32 original and
+    # iter_graphs() does the same cast on rehydration.
+    graph = Data.Data(x=node_features, coords=residue_coords, time=timepoint, num_nodes=node_features.shape[0], y = y)
+    graph.edge_index = edge_index.long()
     return graph
 
+def iter_graphs(path):
+    # Lazily rehydrate Data objects from a tensor pack saved by __main__.
+    # x is shared by every frame, so the same tensor is reused.
+    pack = torch.load(path)
+    node_features = pack['x']
+    for t in range(pack['coords'].shape[0]):
+        yield Data.Data(x=node_features, coords=pack['coords'][t],
+                        time=pack['time'][t].item(),
+                        num_nodes=node_features.shape[0],
+                        edge_index=pack['edge_index'][t].long(), y=pack['y'][t])
+
 if __name__ == "__main__":
     # Load trajectory data
     traj = load_data()
@@ -69,19 +142,41 @@ if __name__ == "__main__":
     # Create a list to store PyTorch Geometric graphs
     graphs = []
     property = 'rog'
+    # Residue layout, names and one-hot features are identical across frames,
+    # compute them once and reuse the same tensor for every graph
+    residue_starts, counts = residue_layout(traj)
+    residue_names = [residue.name for residue in traj.top.residues]
+    node_features = one_hot_encode(residue_names)
+    # Mean coords, kNN and the target property for the whole trajectory
+    # in batched calls
+    all_coords = residue_means(traj.xyz, residue_starts, counts)
+    all_nbrs = knn_all_frames(all_coords, 5)
+    all_y = compute_property(traj, property)
+    edge_indices = stack_edge_indices(all_nbrs)
     # Iterate over each frame in the trajectory and create a graph for each timepoint
     for frame_idx in range(traj.n_frames):
         # import pdb; pdb.set_trace()
-        graph = create_pyg_graph(traj, frame_idx, property)
+        graph = create_pyg_graph(traj, frame_idx, property, node_features, all_coords[frame_idx], edge_indices[frame_idx], all_y[frame_idx])
         graphs.append(graph)
     
-    # Define the filename for the output .pkl file
-    output_filename = f"graphs{property}.pkl"
+    # Every frame shares the same topology, so store one SoA tensor pack
+    # (x deduped across frames) instead of pickling T small Data objects
+    pack = {
+        'x': node_features,
+        'coords': torch.stack([torch.as_tensor(graph.coords) for graph in graphs]),
+        'edge_index': edge_indices,
+        'time': torch.tensor([graph.time for graph in graphs]),
+        'y': torch.as_tensor(np.array([graph.y for graph in graphs], dtype=np.float32)),
+    }
+    output_filename = f"graphs{property}.pt"
+    torch.save(pack, output_filename, _use_new_zipfile_serialization=True)
 
-    # Save the list of graphs to the .pkl file
-    with open(output_filename, 'wb') as f:
-        pickle.dump(graphs, f)
+    # the training/testing scripts still read the pickled graph list, so keep
+    # emitting it alongside the pack until they move to iter_graphs()
+    legacy_filename = f"graphs{property}.pkl"
+    with open(legacy_filename, 'wb') as f:
+        pickle.dump(graphs, f, protocol=pickle.HIGHEST_PROTOCOL)
 
-    print(f"Graphs saved to {output_filename}")
+    print(f"Graphs saved to {output_filename} and {legacy_filename}")
     
 
@@ -3,48 +3,67 @@ from load_atom3d import ProtGraphTransform, dev_prot_df_to_graph, Rg
 from tqdm import tqdm
 from atom3d.datasets import LMDBDataset
 from torch_geometric.data import Data
+from concurrent.futures import ProcessPoolExecutor
 import pickle
 import warnings
 # Ignore all warnings temporarily
 warnings.filterwarnings("ignore")
+
+def _build_graph(job):
+    # worker for progsnn_loader, builds one PyG graph from a mutated-atoms dataframe
+    item, label, property = job
+    if property == 'Rg':
+        label = Rg(item)
+    node_feats, edge_index, edge_feats, pos = dev_prot_df_to_graph(item, feat_col='resname')
+    return Data(node_feats, edge_index, edge_feats, y=label, pos=pos)
+
+def _write_shard(out_prefix, shard_idx, graphs):
+    path = '{}_part{:03d}.pk'.format(out_prefix, shard_idx)
+    with open(path, 'wb') as f:
+        # protocol 5 serializes the tensor buffers out-of-band instead of
+        # through the default protocol's slower per-object path
+        pickle.dump(graphs, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
 class Atom3dLoader:
     def __init__(self, dataset_path):
         self.dataset = dataset_path
     def load_data(self):
         full_dataset = LMDBDataset(self.dataset)
         return full_dataset
-    def progsnn_loader(self, full_dataset, data, property= None):
-        dataset = []
-        if data == "msp":
-            # diff = full_dataset[0]['mutated_atoms'][full_dataset[0]['mutated_atoms'].ne(full_dataset[1]['mutated_atoms']).any(axis=0)]
-            # import pdb; pdb.set_trace()
-            for x in tqdm(full_dataset):
-                item = x['mutated_atoms']
-                # print(item['element'][2497])
-            
-                # has_na = item.isna().any().any()
-                # # Check for 0 values
-                # has_zero = (item == 0).any().any()
-                # if has_na:
-                #     print("AYO WHAT!")
-                # import pdb; pdb.set_trace()
-                if property == 'Rg':
-                    rg = Rg(item)
-                    node_feats, edge_index, edge_feats, pos = dev_prot_df_to_graph(item,feat_col='resname')
-                    graph = Data(node_feats, edge_index, edge_feats, y=rg, pos=pos)
-                    dataset.append(graph)
-                else:
-                    node_feats, edge_index, edge_feats, pos = dev_prot_df_to_graph(item,feat_col='resname')
-                    graph = Data(node_feats, edge_index, edge_feats, y=x['label'], pos=pos)
-                    dataset.append(graph)
-
-        return dataset
+    def progsnn_loader(self, full_dataset, data, property=None, out_prefix=None,
+                       chunk_size=1024, n_workers=None):
+        # Graph construction is CPU-bound numpy/pandas work, so fan it out
+        # across processes and overlap it with the LMDB reads. With
+        # out_prefix set, graphs are flushed to part files every chunk_size
+        # items so memory stays bounded by one chunk; the shard paths are
+        # returned instead of the graphs.
+        if data != "msp":
+            return []
+        # diff = full_dataset[0]['mutated_atoms'][full_dataset[0]['mutated_atoms'].ne(full_dataset[1]['mutated_atoms']).any(axis=0)]
+        # import pdb; pdb.set_trace()
+        jobs = ((x['mutated_atoms'], x['label'], property) for x in full_dataset)
+        chunk = []
+        shard_paths = []
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            for graph in tqdm(pool.map(_build_graph, jobs, chunksize=8),
+                              total=len(full_dataset)):
+                chunk.append(graph)
+                if out_prefix is not None and len(chunk) >= chunk_size:
+                    shard_paths.append(_write_shard(out_prefix, len(shard_paths), chunk))
+                    chunk = []
+        if out_prefix is None:
+            return chunk
+        if chunk:
+            shard_paths.append(_write_shard(out_prefix, len(shard_paths), chunk))
+        return shard_paths
     def VAE_loader(self, full_dataset, data, property):
         pass
 
 if __name__ == '__main__':
     data = Atom3dLoader('../data/raw/MSP/data/')
     full_data = data.load_data()
-    data = data.progsnn_loader(full_data, data='msp', property='Rg')
-    with open('data_msp_rg.pk', 'wb') as f:
-        pickle.dump(data, f)
\ No newline at end of file
+    shards = data.progsnn_loader(full_data, data='msp', property='Rg',
+                                 out_prefix='data_msp_rg')
+    print("Wrote shards:")
+    print(shards)
@@ -52,34 +52,38 @@ import sys
 import argparse
 import itertools
 import numpy # for arange,around,floor,log10,median
+import pandas as pd # for read_csv C-engine parsing
 from collections import defaultdict
 
 def read_generic_data(datafile, delimiter, scorecolumn, sitecolumn=0, chaincolumn=None, defaultchain="A"):
 	'''read generic data file, and return a dict key is site number and value is score'''
-	rawscore_dict = defaultdict(dict) # key is chain, value is dict of site and raw score
-	linecounter = 0
-	foundscores = 0
-	columnmax = 0
+	rawscore_dict = {} # key is chain, value is dict of site and raw score
 	sys.stderr.write("# Reading scores from column {} in {}, separated by {}\n".format( scorecolumn, datafile, delimiter ) )
-	for line in open(datafile, 'r'):
-		line = line.strip()
-		if line and line[0]!="#":
-			linecounter += 1
-			lsplits = line.split(delimiter)
-			if len(lsplits) > columnmax:
-				columnmax = len(lsplits)
-			sitecol = lsplits[sitecolumn] # raw, might be string
-			try: # check if can be turned into integer
-				site = int(float(sitecol))
-			except ValueError: # no value, row is empty in this column or is header
-				continue
-			score = float(lsplits[scorecolumn])
-			if type(chaincolumn) is int:
-				chain = lsplits[int(chaincolumn)]
-			else: # use default chain
-				chain = defaultchain
-			rawscore_dict[chain][site] = float(score)
-			foundscores += 1
+	# let the pandas C engine do the per-row strip/split/float work; empty and
+	# ragged files degrade to the zero-score diagnostics below, like the old row loop
+	try:
+		df = pd.read_csv(datafile, sep=delimiter, comment="#", header=None, engine="c")
+	except (pd.errors.EmptyDataError, pd.errors.ParserError):
+		df = pd.DataFrame()
+	linecounter = len(df)
+	columnmax = df.shape[1]
+	foundscores = 0
+	# with the wrong -d the whole line parses as one column, so the requested
+	# columns may not exist; fall through to the warning instead of a KeyError
+	if sitecolumn < columnmax and scorecolumn < columnmax:
+		# rows whose site column is not numeric are headers or empty cells, as before
+		sites = pd.to_numeric(df[sitecolumn], errors="coerce")
+		keep = sites.notna()
+		site_arr = sites[keep].astype(int).to_numpy()
+		score_arr = pd.to_numeric(df.loc[keep, scorecolumn]).astype(float).to_numpy()
+		foundscores = len(site_arr)
+		if type(chaincolumn) is int and chaincolumn < columnmax:
+			chain_arr = df.loc[keep, chaincolumn].astype(str).to_numpy()
+			for chain in pd.unique(chain_arr):
+				chainmask = chain_arr == chain
+				rawscore_dict[chain] = dict(zip(site_arr[chainmask].tolist(), score_arr[chainmask].tolist()))
+		else: # use default chain
+			rawscore_dict[defaultchain] = dict(zip(site_arr.tolist(), score_arr.tolist()))
 	sys.stderr.write("# Counted {} lines with {} scores\n".format( linecounter, foundscores ) )
 	if foundscores==0:
 		if columnmax < 2:
@@ -115,6 +119,23 @@ def get_chains_only(defaultchain, seqidlist, pdbfile):
 		sys.stderr.write("### using default chain {}\n".format( defaultchain ) )
 	return keepchains, refoffsets
 
+def compress_ranges(residues):
+	'''collapse residue numbers into PyMOL selection tokens, e.g. 5-12+15+20-25'''
+	resi_arr = numpy.sort( numpy.asarray(residues, dtype=numpy.int64) )
+	if resi_arr.size == 0:
+		return ""
+	# runs of consecutive residues become single start-end tokens
+	breaks = numpy.where( numpy.diff(resi_arr) != 1 )[0]
+	starts = numpy.concatenate( ([0], breaks + 1) )
+	ends = numpy.concatenate( (breaks, [resi_arr.size - 1]) )
+	tokens = []
+	for s,e in zip(starts, ends):
+		if s == e:
+			tokens.append( str(resi_arr[s]) )
+		else:
+			tokens.append( "{}-{}".format(resi_arr[s], resi_arr[e]) )
+	return "+".join(tokens)
+
 def make_output_script(wayout, scoredict, keepchains, refoffsets, groupname, exclude_common, default_chain_grp=None, basecolor="red", reverse_colors=False, ZEROOVERRIDE=0.0):
 	'''from the identity calculations, print a script for PyMOL'''
 	###
@@ -169,10 +190,12 @@ def make_output_script(wayout, scoredict, keepchains, refoffsets, groupname, exc
 	###
 	### DETERMINE OPTIMAL BIN VALUES DIRECTLY FROM DATA ###
 	###
-	all_scores = list( itertools.chain( list(rd.values()) for rd in scoredict.values() ) )[0]
+	# chain.from_iterable flattens across all chains; the previous
+	# itertools.chain(generator)[0] kept only the first chain's scores
+	all_scores = numpy.fromiter( itertools.chain.from_iterable(rd.values() for rd in scoredict.values()), dtype=numpy.float64 )
 	sys.stderr.write("# Generating list of bins from data\n")
-	lowest_val = min(all_scores)
-	highest_val = max(all_scores)
+	lowest_val = all_scores.min()
+	highest_val = all_scores.max()
 	val_range = highest_val - lowest_val
 	magnitude = int(numpy.floor(numpy.log10(val_range)))
 
@@ -256,15 +279,17 @@ def make_output_script(wayout, scoredict, keepchains, refoffsets, groupname, exc
 	for chain in keepchains.keys(): # keys are chain letters, values are seq IDs
 		chainoffset = refoffsets.get(chain, 0)
 		scoregroups = defaultdict(list) # key is percent group, value is list of residues
-		# for each residue, assign to a bin
-		for residue in scoredict[chain].keys():
-			residuescore = scoredict[chain].get(residue,0.00)
-			for i,value in enumerate(binvalues[:-1]):
-				upper = binvalues[i+1]
-				if residuescore < upper:
-					scoregroups[value].append(residue - chainoffset)
-					break
-			# should not need an else if last bin is large enough
+		# assign every residue to a bin in one vectorized searchsorted,
+		# a residue falls in bin i when score < binvalues[i+1], and scores
+		# beyond the last upper bound stay unassigned, as in the old loop
+		chainscores = scoredict.get(chain, {}) # chains without scores just get the base color
+		residues_arr = numpy.fromiter(chainscores.keys(), dtype=numpy.int64)
+		scores_arr = numpy.fromiter(chainscores.values(), dtype=numpy.float64)
+		bin_idx = numpy.searchsorted(binvalues[1:], scores_arr, side='right')
+		for i,value in enumerate(binvalues[:-1]):
+			binmembers = residues_arr[bin_idx==i]
+			if binmembers.size:
+				scoregroups[value] = (binmembers - chainoffset).tolist()
 		# assign whole chain to lowest color, then build up
 		wayout.write("color {}{:02d}, chain {}\n".format( basecolor, int(binvalues[defaultindex]*binname_correction), chain ) )
 		# for each bin, make a command to color all residues of that bin
@@ -272,9 +297,10 @@ def make_output_script(wayout, scoredict, keepchains, refoffsets, groupname, exc
 			if i==defaultindex and exclude_common: # long lists apparently crash the program, so skip
 				continue
 			binname = "{:02d}_{}_{}_{}".format( int(value*binname_correction), groupname, i+1, chain )
-			resilist = list(map(str,scoregroups[value]))
-			if resilist: # do not print empty groups
-				binresidues = ",".join(resilist)
+			# consecutive residues collapse to start-end tokens, which keeps
+			# the script short and is also faster for PyMOL to parse
+			binresidues = compress_ranges(scoregroups[value])
+			if binresidues: # do not print empty groups
 				wayout.write("select {}, (chain {} & resi {})\n".format( binname, chain, binresidues ) )
 				wayout.write("color {}{:02d}, {}\n".format( basecolor, int(value*binname_correction), binname ) )
 	# no return
@@ -1,5 +1,6 @@
 from argparse import ArgumentParser
 import datetime
+import glob
 import os
 import numpy as np
 
@@ -55,8 +56,17 @@ if __name__ == '__main__':
     torch.cuda.empty_cache()
     
     # full_dataset = DEShaw('graphs/total_graphs.pkl')
-    with open('atom3d_processing/data_msp_rg.pk', 'rb') as file:
-        full_dataset =  pickle.load(file)
+    # the preprocessing script writes chunked data_msp_rg_part*.pk shards;
+    # fall back to the old monolithic pickle when none are present
+    shard_paths = sorted(glob.glob('atom3d_processing/data_msp_rg_part*.pk'))
+    if shard_paths:
+        full_dataset = []
+        for shard_path in shard_paths:
+            with open(shard_path, 'rb') as file:
+                full_dataset.extend(pickle.load(file))
+    else:
+        with open('atom3d_processing/data_msp_rg.pk', 'rb') as file:
+            full_dataset =  pickle.load(file)
     
     # full_dataset = LMDBDataset('data/msp/raw/MSP/data/')
     # import pdb; pdb.set_trace()